@@ -0,0 +1,589 @@
+"""競馬データの分析ロジック"""
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_, bindparam, case, func, select, text
+
+from cache import redis_cached
+from database import (
+    HORSE_STATS_VIEWS,
+    Horse,
+    HotHorseDaily,
+    Race,
+    RaceResult,
+)
+
+try:
+    from numba import njit
+    _HAS_NUMBA = True
+except ImportError:  # numbaは任意依存。無ければNumPyのbincountで代替する
+    _HAS_NUMBA = False
+
+
+def _aggregate_rankings_numpy(group_ids, rankings, n_groups):
+    """グループ別の (出走数, 勝利数, 複勝数, 着順合計) を一括集計する"""
+    races = np.bincount(group_ids, minlength=n_groups)
+    wins = np.bincount(group_ids, weights=(rankings == 1), minlength=n_groups)
+    top3 = np.bincount(group_ids, weights=(rankings <= 3), minlength=n_groups)
+    rank_sum = np.bincount(group_ids, weights=rankings, minlength=n_groups)
+    return races, wins, top3, rank_sum
+
+
+if _HAS_NUMBA:
+    # cache=True でプロセス起動ごとの再コンパイルを避ける。集計は
+    # 同一要素へのスキャッタ加算なので並列化はせず単一のタイトループにする
+    @njit(cache=True)
+    def _aggregate_rankings(group_ids, rankings, n_groups):
+        races = np.zeros(n_groups, dtype=np.int64)
+        wins = np.zeros(n_groups, dtype=np.float64)
+        top3 = np.zeros(n_groups, dtype=np.float64)
+        rank_sum = np.zeros(n_groups, dtype=np.float64)
+        for i in range(group_ids.shape[0]):
+            g = group_ids[i]
+            r = rankings[i]
+            races[g] += 1
+            rank_sum[g] += r
+            if r == 1:
+                wins[g] += 1
+            if r <= 3:
+                top3[g] += 1
+        return races, wins, top3, rank_sum
+else:
+    _aggregate_rankings = _aggregate_rankings_numpy
+
+
+def _cutoff(days):
+    """日次粒度の集計起点日を返す
+
+    datetime.now() ではなく date.today() 起点に揃えることで、同一日の
+    呼び出しが常に同じ値になり、日付をキーにしたキャッシュが効く。
+    """
+    return date.today() - timedelta(days=days)
+
+
+# ホットパスのSELECTはモジュールロード時に一度だけ組み立て、実行時は
+# bindparam へ値を差し込むだけにする。コンパイル済みSQLはエンジンの
+# query cache に載り、呼び出しごとの式ツリー構築・コンパイルを省ける
+_WIN_RATE_STMT = (
+    select(
+        func.count(RaceResult.id),
+        func.coalesce(func.sum(case((RaceResult.ranking == 1, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((RaceResult.ranking <= 3, 1), else_=0)), 0),
+    )
+    .select_from(RaceResult)
+    .join(Race, RaceResult.race_id == Race.race_id)
+    .where(
+        RaceResult.horse_id == bindparam('horse_id'),
+        Race.race_date >= bindparam('cutoff_date'),
+    )
+)
+
+_JOCKEY_STATS_STMT = (
+    select(
+        func.count(),
+        func.coalesce(func.sum(case((RaceResult.ranking == 1, 1), else_=0)), 0),
+        func.avg(RaceResult.ranking),
+        func.avg(RaceResult.odds),
+    )
+    .select_from(RaceResult)
+    .join(Race, RaceResult.race_id == Race.race_id)
+    .where(
+        RaceResult.jockey == bindparam('jockey'),
+        RaceResult.ranking.isnot(None),
+        Race.race_date >= bindparam('cutoff_date'),
+    )
+)
+
+
+class KeibaAnalyzer:
+    """蓄積したレースデータから各種統計を計算する
+
+    セッションは DatabaseManager の scoped_session から取得する。
+    メソッド内では close しない — リクエスト終了時（Flask の
+    teardown_appcontext）に呼び出し側が Session.remove() する。
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    @property
+    def session(self):
+        return self.db.get_session()
+
+    def calculate_win_rate(self, horse_id, days=365):
+        """指定馬の勝率・複勝率を計算する（集計はDB側で実行）"""
+        view = self._horse_stats_view(days)
+        if view is not None:
+            return self._win_rate_from_view(view, horse_id)
+        cutoff_date = _cutoff(days)
+        total, wins, top3 = self.session.execute(
+            _WIN_RATE_STMT,
+            {'horse_id': horse_id, 'cutoff_date': cutoff_date},
+        ).one()
+        if not total:
+            return {'races': 0, 'wins': 0, 'top3': 0,
+                    'win_rate': 0.0, 'top3_rate': 0.0}
+        return {
+            'races': total,
+            'wins': int(wins),
+            'top3': int(top3),
+            'win_rate': round(wins / total * 100, 1),
+            'top3_rate': round(top3 / total * 100, 1),
+        }
+
+    def _horse_stats_view(self, days):
+        """日数に対応するロールアップビュー名を返す（なければ None）"""
+        if not getattr(self.db, 'has_horse_stats_views', False):
+            return None
+        for name, view_days in HORSE_STATS_VIEWS.items():
+            if view_days == days:
+                return name
+        return None
+
+    def _win_rate_from_view(self, view, horse_id):
+        """マテリアライズドビューからO(1)で勝率を引く"""
+        row = self.session.execute(
+            text(f'SELECT races, wins, top3 FROM {view} '
+                 'WHERE horse_id = :horse_id'),
+            {'horse_id': horse_id},
+        ).first()
+        if row is None:
+            return {'races': 0, 'wins': 0, 'top3': 0,
+                    'win_rate': 0.0, 'top3_rate': 0.0}
+        races, wins, top3 = row
+        return {
+            'races': races,
+            'wins': int(wins),
+            'top3': int(top3),
+            'win_rate': round(wins / races * 100, 1),
+            'top3_rate': round(top3 / races * 100, 1),
+        }
+
+    @redis_cached('track')
+    def analyze_track_condition(self, horse_id):
+        """馬場状態別の成績を分析する"""
+        # 集計はDB側の GROUP BY に任せ、馬場状態ごとに1行だけ受け取る
+        rows = self.session.execute(
+            select(
+                Race.track_condition,
+                func.count(),
+                func.sum(case((RaceResult.ranking == 1, 1), else_=0)),
+                func.avg(RaceResult.ranking),
+            )
+            .select_from(RaceResult)
+            .join(Race, RaceResult.race_id == Race.race_id)
+            .where(
+                RaceResult.horse_id == horse_id,
+                RaceResult.ranking.isnot(None),
+            )
+            .group_by(Race.track_condition)
+        ).all()
+        analysis = {}
+        for condition, races, wins, avg_ranking in rows:
+            analysis[condition or '不明'] = {
+                'races': races,
+                'wins': int(wins),
+                'win_rate': round(wins / races * 100, 1),
+                'avg_ranking': round(float(avg_ranking), 2),
+            }
+        return analysis
+
+    # np.digitize 用の距離帯境界（右閉区間）とカテゴリ名
+    _DISTANCE_BINS = [1400, 1800, 2200]
+    _DISTANCE_LABELS = ['短距離', 'マイル', '中距離', '長距離']
+
+    @redis_cached('distance')
+    def analyze_distance_performance(self, horse_id):
+        """距離帯別の成績を分析する"""
+        rows = self.session.execute(
+            select(RaceResult.ranking, Race.distance)
+            .join(Race, RaceResult.race_id == Race.race_id)
+            .where(
+                RaceResult.horse_id == horse_id,
+                RaceResult.ranking.isnot(None),
+                Race.distance.isnot(None),
+            )
+        ).all()
+        if not rows:
+            return {}
+
+        # 行×カテゴリの二重ループではなく、digitize + bincount の
+        # C レベル集計で距離帯を割り当てる。行リストは1回の変換で
+        # 2列まとめて配列化する（2度のイテレーションを融合）
+        arr = np.asarray(rows, dtype=np.float64)
+        rankings = arr[:, 0]
+        distances = arr[:, 1]
+        n_cats = len(self._DISTANCE_LABELS)
+        cats = np.digitize(distances, self._DISTANCE_BINS, right=True)
+        races_per_cat = np.bincount(cats, minlength=n_cats)
+        wins_per_cat = np.bincount(
+            cats, weights=(rankings == 1), minlength=n_cats)
+        rank_sum_per_cat = np.bincount(
+            cats, weights=rankings, minlength=n_cats)
+
+        analysis = {}
+        for i, category in enumerate(self._DISTANCE_LABELS):
+            races = int(races_per_cat[i])
+            if not races:
+                continue
+            wins = int(wins_per_cat[i])
+            analysis[category] = {
+                'races': races,
+                'wins': wins,
+                'win_rate': round(wins / races * 100, 1),
+                'avg_ranking': round(rank_sum_per_cat[i] / races, 2),
+            }
+        return analysis
+
+    def analyze_jockey_performance(self, jockey, days=365):
+        """騎手の成績を分析する"""
+        cutoff_date = _cutoff(days)
+        races, wins, avg_ranking, avg_odds = self.session.execute(
+            _JOCKEY_STATS_STMT,
+            {'jockey': jockey, 'cutoff_date': cutoff_date},
+        ).one()
+        if not races:
+            return {'races': 0, 'wins': 0, 'win_rate': 0.0,
+                    'avg_ranking': 0.0, 'avg_odds': 0.0}
+        return {
+            'races': races,
+            'wins': int(wins),
+            'win_rate': round(wins / races * 100, 1),
+            'avg_ranking': round(float(avg_ranking), 2),
+            'avg_odds': (round(float(avg_odds), 1)
+                         if avg_odds is not None else 0.0),
+        }
+
+    def analyze_return_rate(self, strategy='favorite', days=30):
+        """馬券戦略ごとの回収率を計算する
+
+        strategy: 'favorite'（1番人気）/ 'longshot'（人気薄の高オッズ）/
+        'value'（オッズ÷人気の妙味）
+        """
+        cutoff_date = _cutoff(days)
+        picks = self._strategy_picks(strategy, cutoff_date)
+        if picks is None:
+            return self._format_return_rate(strategy, 0, 0, 0)
+
+        # 買い目の選定から払戻の合計まで、すべてDB側の1文で計算する
+        bets, hits, returns = self.session.execute(
+            select(
+                func.count(),
+                func.coalesce(
+                    func.sum(case((picks.c.ranking == 1, 1), else_=0)), 0),
+                func.coalesce(
+                    func.sum(case((picks.c.ranking == 1,
+                                   picks.c.odds * 100), else_=0.0)), 0.0),
+            )
+            .select_from(picks)
+        ).one()
+        return self._format_return_rate(strategy, bets, hits, returns)
+
+    def analyze_return_rates_bulk(self,
+                                  strategies=('favorite', 'longshot',
+                                              'value'),
+                                  days=30):
+        """複数戦略の回収率を1回のスキャンでまとめて計算する
+
+        analyze_return_rate を戦略ごとに呼ぶと同じ期間の race_results を
+        戦略の数だけ走査する。ここでは窓関数で各戦略の買い目フラグを
+        1つのサブクエリに相乗りさせ、外側の SUM(CASE ...) 群を1文で
+        流すことで、スキャンもDB往復も1回に抑える。
+        戻り値は {strategy: analyze_return_rate と同形の dict}。
+        """
+        cutoff_date = _cutoff(days)
+        columns = [RaceResult.race_id, RaceResult.ranking,
+                   RaceResult.odds, RaceResult.popularity]
+        if 'longshot' in strategies:
+            valid = case((and_(RaceResult.popularity >= 10,
+                               RaceResult.odds.isnot(None)), 0), else_=1)
+            columns.append(
+                func.row_number()
+                .over(partition_by=RaceResult.race_id,
+                      order_by=(valid, RaceResult.odds.desc()))
+                .label('rn_longshot'))
+        if 'value' in strategies:
+            valid = case((and_(RaceResult.popularity.isnot(None),
+                               RaceResult.odds.isnot(None)), 0), else_=1)
+            columns.append(
+                func.row_number()
+                .over(partition_by=RaceResult.race_id,
+                      order_by=(valid, (RaceResult.odds
+                                        / RaceResult.popularity).desc()))
+                .label('rn_value'))
+        rows = (
+            select(*columns)
+            .join(Race, RaceResult.race_id == Race.race_id)
+            .where(Race.race_date >= cutoff_date)
+            .subquery()
+        )
+
+        conditions = {}
+        for strategy in strategies:
+            if strategy == 'favorite':
+                conditions[strategy] = rows.c.popularity == 1
+            elif strategy == 'longshot':
+                conditions[strategy] = and_(rows.c.rn_longshot == 1,
+                                            rows.c.popularity >= 10,
+                                            rows.c.odds.isnot(None))
+            elif strategy == 'value':
+                conditions[strategy] = and_(rows.c.rn_value == 1,
+                                            rows.c.popularity.isnot(None),
+                                            rows.c.odds.isnot(None))
+            else:
+                conditions[strategy] = None
+
+        aggregates = []
+        for strategy, cond in conditions.items():
+            if cond is None:
+                continue
+            hit = and_(cond, rows.c.ranking == 1)
+            aggregates.extend([
+                func.coalesce(func.sum(case((cond, 1), else_=0)), 0),
+                func.coalesce(func.sum(case((hit, 1), else_=0)), 0),
+                func.coalesce(
+                    func.sum(case((hit, rows.c.odds * 100), else_=0.0)),
+                    0.0),
+            ])
+        values = (self.session.execute(
+            select(*aggregates).select_from(rows)).one()
+            if aggregates else ())
+
+        out = {}
+        i = 0
+        for strategy, cond in conditions.items():
+            if cond is None:
+                out[strategy] = self._format_return_rate(strategy, 0, 0, 0)
+                continue
+            bets, hits, returns = values[3 * i:3 * i + 3]
+            out[strategy] = self._format_return_rate(
+                strategy, bets, hits, returns)
+            i += 1
+        return out
+
+    @staticmethod
+    def _format_return_rate(strategy, bets, hits, returns):
+        """集計値を analyze_return_rate の戻り値の形に整える"""
+        if not bets:
+            return {'strategy': strategy, 'bets': 0, 'hits': 0,
+                    'hit_rate': 0.0, 'investment': 0, 'returns': 0,
+                    'return_rate': 0.0}
+        investment = bets * 100
+        return {
+            'strategy': strategy,
+            'bets': bets,
+            'hits': int(hits),
+            'hit_rate': round(hits / bets * 100, 1),
+            'investment': investment,
+            'returns': round(returns),
+            'return_rate': round(returns / investment * 100, 1),
+        }
+
+    @staticmethod
+    def _strategy_picks(strategy, cutoff_date):
+        """戦略ごとの買い目（レースにつき1頭）を返すサブクエリを組み立てる"""
+        base = (
+            select(RaceResult.race_id, RaceResult.ranking, RaceResult.odds)
+            .join(Race, RaceResult.race_id == Race.race_id)
+            .where(Race.race_date >= cutoff_date)
+        )
+        if strategy == 'favorite':
+            return base.where(RaceResult.popularity == 1).subquery()
+        if strategy == 'longshot':
+            order_key = RaceResult.odds.desc()
+            extra = [RaceResult.popularity >= 10, RaceResult.odds.isnot(None)]
+        elif strategy == 'value':
+            order_key = (RaceResult.odds / RaceResult.popularity).desc()
+            extra = [RaceResult.popularity.isnot(None),
+                     RaceResult.odds.isnot(None)]
+        else:
+            return None
+        rn = (
+            func.row_number()
+            .over(partition_by=RaceResult.race_id, order_by=order_key)
+            .label('rn')
+        )
+        ranked = base.add_columns(rn).where(*extra).subquery()
+        return (
+            select(ranked.c.race_id, ranked.c.ranking, ranked.c.odds)
+            .where(ranked.c.rn == 1)
+            .subquery()
+        )
+
+    def get_hot_horses(self, days=30, limit=10):
+        """直近の成績が良い「調子の良い馬」を抽出する
+
+        戻り値はレコードのリストではなく列指向の dict
+        （数値列は ndarray、文字列列は list）。plotly にはそのまま、
+        表表示には pa.table() 経由で渡せる。
+        """
+        # 標準の30日窓は書き込み時に更新されるロールアップから引く
+        if days == 30:
+            rollup = self._hot_horses_from_rollup(limit)
+            if rollup is not None:
+                return rollup
+        cutoff_date = _cutoff(days)
+        stmt = (
+            select(
+                RaceResult.horse_id,
+                Horse.horse_name,
+                RaceResult.ranking,
+            )
+            .join(Horse, RaceResult.horse_id == Horse.horse_id)
+            .join(Race, RaceResult.race_id == Race.race_id)
+            .where(
+                Race.race_date >= cutoff_date,
+                RaceResult.ranking.isnot(None),
+            )
+        )
+        df = pd.read_sql(stmt, self.session.bind)
+        if df.empty:
+            return {}
+
+        # 馬ごとの集計は factorize + JITカーネルの一括パスで行う
+        group_ids, uniques = pd.factorize(df['horse_id'])
+        rankings = df['ranking'].to_numpy(dtype=np.float64)
+        races, wins, top3, rank_sum = _aggregate_rankings(
+            group_ids.astype(np.int64), rankings, len(uniques))
+
+        names = (df.drop_duplicates('horse_id')
+                 .set_index('horse_id')['horse_name'])
+        agg = pd.DataFrame({
+            'horse_id': uniques,
+            'horse_name': names.reindex(uniques).to_numpy(),
+            'races': races,
+            'wins': wins.astype(np.int64),
+            'top3': top3.astype(np.int64),
+            'avg_ranking': rank_sum / races,
+        })
+        agg = agg[agg['races'] >= 2]
+        if agg.empty:
+            return {}
+        agg['score'] = (agg['wins'] / agg['races'] * 300
+                        + agg['top3'] / agg['races'] * 200
+                        + (20 - agg['avg_ranking']) * 5)
+        agg['avg_ranking'] = agg['avg_ranking'].round(2)
+        agg['score'] = agg['score'].round(1)
+        top = agg.nlargest(limit, 'score')
+        return {
+            'horse_id': top['horse_id'].tolist(),
+            'horse_name': top['horse_name'].tolist(),
+            'races': top['races'].to_numpy(),
+            'wins': top['wins'].to_numpy(),
+            'top3': top['top3'].to_numpy(),
+            'avg_ranking': top['avg_ranking'].to_numpy(),
+            'score': top['score'].to_numpy(),
+        }
+
+    def _hot_horses_from_rollup(self, limit):
+        """hot_horses_daily から上位 limit 件を読む（未整備なら None）"""
+        rows = self.session.execute(
+            select(
+                HotHorseDaily.horse_id,
+                HotHorseDaily.horse_name,
+                HotHorseDaily.races,
+                HotHorseDaily.wins,
+                HotHorseDaily.top3,
+                HotHorseDaily.avg_ranking,
+                HotHorseDaily.score,
+            )
+            .order_by(HotHorseDaily.score.desc())
+            .limit(limit)
+        ).all()
+        if not rows:
+            return None
+        cols = tuple(zip(*rows))
+        return {
+            'horse_id': list(cols[0]),
+            'horse_name': list(cols[1]),
+            'races': np.asarray(cols[2]),
+            'wins': np.asarray(cols[3]),
+            'top3': np.asarray(cols[4]),
+            'avg_ranking': np.asarray(cols[5]),
+            'score': np.asarray(cols[6]),
+        }
+
+    def predict_race_result(self, race_id):
+        """過去成績と人気からレースの着順を予測する"""
+        session = self.session
+        entries = session.execute(
+            select(
+                RaceResult.horse_id,
+                RaceResult.horse_name,
+                RaceResult.horse_number,
+                RaceResult.popularity,
+            )
+            .where(RaceResult.race_id == race_id)
+        ).all()
+        if not entries:
+            return []
+
+        # 出走馬ごとに直近5走を引くN+1を避け、ROW_NUMBER() で
+        # 馬別の直近5走を1クエリでまとめて取得する
+        entry_horse_ids = [e.horse_id for e in entries if e.horse_id]
+        rn = (
+            func.row_number()
+            .over(partition_by=RaceResult.horse_id,
+                  order_by=RaceResult.id.desc())
+            .label('rn')
+        )
+        sub = (
+            select(
+                RaceResult.horse_id,
+                RaceResult.ranking,
+                rn,
+            )
+            .where(
+                RaceResult.horse_id.in_(entry_horse_ids),
+                RaceResult.race_id != race_id,
+            )
+            .subquery()
+        )
+        past = pd.DataFrame(
+            session.execute(
+                select(sub.c.horse_id, sub.c.ranking)
+                .where(sub.c.rn <= 5, sub.c.ranking.isnot(None))
+            ).all(),
+            columns=['horse_id', 'ranking'],
+        )
+
+        # スコア計算は馬ごとのPythonループではなく、groupby + NumPy式の
+        # 一括パスで行う
+        # 列ごとの4重リスト内包ではなく、タプル行から一度で組み立てる
+        df = pd.DataFrame(
+            entries,
+            columns=['horse_id', 'horse_name', 'horse_number', 'popularity'],
+        )
+        if past.empty:
+            df['avg_ranking'] = np.nan
+            df['n_past'] = 0
+            df['past_wins'] = 0
+        else:
+            form = (
+                past.groupby('horse_id')['ranking']
+                .agg(avg_ranking='mean',
+                     n_past='size',
+                     past_wins=lambda s: int((s == 1).sum()))
+            )
+            df = df.join(form, on='horse_id')
+            df['n_past'] = df['n_past'].fillna(0)
+            df['past_wins'] = df['past_wins'].fillna(0)
+
+        has_past = df['n_past'] > 0
+        df['score'] = np.where(
+            has_past,
+            (20 - df['avg_ranking']) * 5
+            + df['past_wins'] / df['n_past'].replace(0, 1) * 200,
+            50.0,
+        )
+        popularity = pd.to_numeric(df['popularity'], errors='coerce')
+        df['score'] += np.where(popularity.notna(), (20 - popularity) * 3, 0.0)
+
+        df['avg_ranking'] = df['avg_ranking'].round(2)
+        df['score'] = df['score'].round(1)
+        df = df.sort_values('score', ascending=False)
+        df = df.drop(columns=['n_past', 'past_wins'])
+        df['avg_ranking'] = df['avg_ranking'].astype(object).where(
+            df['avg_ranking'].notna(), None)
+        return df.to_dict('records')
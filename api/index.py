@@ -0,0 +1,227 @@
+"""Flask API エントリポイント（gunicorn: api.index:app）"""
+import functools
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import orjson
+from cachetools import TTLCache
+from flask import Flask, jsonify, request
+from flask.json.provider import JSONProvider
+from flask_compress import Compress
+from sqlalchemy import select
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analyzer import KeibaAnalyzer
+from database import DatabaseManager, Horse, Race, RaceResult
+
+
+class ORJSONProvider(JSONProvider):
+    """orjson でシリアライズする JSONProvider
+
+    stdlib json より大幅に速く、date/datetime/NumPy 値もネイティブに
+    ISO 文字列へ変換するため、エンドポイント側の strftime が不要になる。
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(
+            obj, option=orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY,
+        ).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+app = Flask(__name__)
+app.json = ORJSONProvider(app)
+
+# JSONレスポンスは馬名・日付の繰り返しが多く、Brotli/gzipで数分の一になる
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_MIN_SIZE'] = 500
+Compress(app)
+
+db = DatabaseManager()
+
+
+class CachedAnalyzer:
+    """分析結果を日付単位でメモ化する薄いプロキシ
+
+    元データは日次バッチでしか増えないため、(引数, 当日) をキーにした
+    lru_cache で同一日内の再計算を省く。predict_race_result だけは
+    レース当日にオッズが動くので1時間TTLのキャッシュにする。
+    """
+
+    def __init__(self, analyzer, maxsize=1024):
+        self._analyzer = analyzer
+        self._memo = functools.lru_cache(maxsize=maxsize)(self._compute)
+        self._predict_cache = TTLCache(maxsize=256, ttl=3600)
+
+    def _compute(self, method, args, _cache_day):
+        return getattr(self._analyzer, method)(*args)
+
+    def _cached(self, method, *args):
+        return self._memo(method, args, date.today().toordinal())
+
+    def calculate_win_rate(self, horse_id, days=365):
+        return self._cached('calculate_win_rate', horse_id, days)
+
+    def analyze_track_condition(self, horse_id):
+        return self._cached('analyze_track_condition', horse_id)
+
+    def analyze_distance_performance(self, horse_id):
+        return self._cached('analyze_distance_performance', horse_id)
+
+    def analyze_return_rate(self, strategy='favorite', days=30):
+        return self._cached('analyze_return_rate', strategy, days)
+
+    def get_hot_horses(self, days=30, limit=10):
+        return self._cached('get_hot_horses', days, limit)
+
+    def predict_race_result(self, race_id):
+        if race_id not in self._predict_cache:
+            self._predict_cache[race_id] = \
+                self._analyzer.predict_race_result(race_id)
+        return self._predict_cache[race_id]
+
+
+analyzer = CachedAnalyzer(KeibaAnalyzer(db))
+
+
+@app.teardown_appcontext
+def _remove_session(exc):
+    # scoped_session をリクエスト終了時に返却する（コミット/クローズ込み）
+    db.remove_session()
+
+
+@app.route('/')
+def index():
+    return jsonify({'name': 'Keiba AI API', 'status': 'ok'})
+
+
+@app.route('/api/race/<race_id>')
+def get_race(race_id):
+    session = db.get_session()
+    race = session.get(Race, race_id)
+    if race is None:
+        return jsonify({'error': 'レースが見つかりません'}), 404
+    results = session.scalars(
+        select(RaceResult)
+        .where(RaceResult.race_id == race_id)
+        .order_by(RaceResult.ranking)
+    ).all()
+    return jsonify({
+        'race_id': race.race_id,
+        'race_name': race.race_name,
+        'race_date': race.race_date,
+        'track': race.track,
+        'distance': race.distance,
+        'track_condition': race.track_condition,
+        'weather': race.weather,
+        'results': [{
+            'ranking': r.ranking,
+            'horse_number': r.horse_number,
+            'horse_id': r.horse_id,
+            'horse_name': r.horse_name,
+            'jockey': r.jockey,
+            'time': r.time,
+            'popularity': r.popularity,
+            'odds': r.odds,
+        } for r in results],
+    })
+
+
+# /api/horse/<id> の3クエリを並列に流すためのプール。scoped_session は
+# スレッドローカルなので、各ワーカーが自分のセッションを使う。
+# teardown_appcontext はリクエストスレッドのセッションしか返却しないため、
+# ワーカー側は finally で自分のセッションを remove() する（さもないと
+# トランザクションを張ったままの接続がプールに戻らず溜まり続ける）
+_executor = ThreadPoolExecutor(max_workers=8)
+
+
+def _fetch_horse(horse_id):
+    try:
+        return db.get_session().get(Horse, horse_id)
+    finally:
+        db.remove_session()
+
+
+def _fetch_recent_results(horse_id):
+    try:
+        return db.get_session().execute(
+            select(RaceResult, Race)
+            .join(Race, RaceResult.race_id == Race.race_id)
+            .where(RaceResult.horse_id == horse_id)
+            .order_by(Race.race_date.desc())
+            .limit(10)
+        ).all()
+    finally:
+        db.remove_session()
+
+
+def _fetch_win_rate(horse_id):
+    try:
+        return analyzer.calculate_win_rate(horse_id)
+    finally:
+        db.remove_session()
+
+
+@app.route('/api/horse/<horse_id>')
+def get_horse(horse_id):
+    # 馬情報・直近成績・勝率集計は独立したクエリなので、逐次ではなく
+    # 接続プール上で並列に実行して最も遅い1本分の時間に収める
+    horse_future = _executor.submit(_fetch_horse, horse_id)
+    recent_future = _executor.submit(_fetch_recent_results, horse_id)
+    stats_future = _executor.submit(_fetch_win_rate, horse_id)
+    horse = horse_future.result()
+    recent_results = recent_future.result()
+    stats = stats_future.result()
+    if horse is None:
+        return jsonify({'error': '馬が見つかりません'}), 404
+    return jsonify({
+        'horse_id': horse.horse_id,
+        'horse_name': horse.horse_name,
+        'birth_date': horse.birth_date,
+        'sex': horse.sex,
+        'trainer': horse.trainer,
+        'owner': horse.owner,
+        'stats': stats,
+        'recent_results': [{
+            'race_id': race.race_id,
+            'race_name': race.race_name,
+            'race_date': race.race_date,
+            'ranking': result.ranking,
+            'popularity': result.popularity,
+            'odds': result.odds,
+        } for result, race in recent_results],
+    })
+
+
+@app.route('/api/analysis/hot-horses')
+def hot_horses():
+    days = request.args.get('days', 30, type=int)
+    limit = request.args.get('limit', 10, type=int)
+    return jsonify({
+        'days': days,
+        'hot_horses': analyzer.get_hot_horses(days=days, limit=limit),
+    })
+
+
+@app.route('/api/analysis/return-rate')
+def return_rate():
+    strategy = request.args.get('strategy', 'favorite')
+    days = request.args.get('days', 30, type=int)
+    return jsonify(analyzer.analyze_return_rate(strategy=strategy, days=days))
+
+
+@app.route('/api/analysis/predict/<race_id>')
+def predict(race_id):
+    return jsonify({
+        'race_id': race_id,
+        'predictions': analyzer.predict_race_result(race_id),
+    })
+
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=8000, debug=True)
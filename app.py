@@ -0,0 +1,376 @@
+"""Streamlit 管理画面（ダッシュボード・データ収集・分析・予測）"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import pyarrow as pa
+import plotly.graph_objects as go
+import streamlit as st
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import load_only
+
+from analyzer import KeibaAnalyzer
+from database import DatabaseManager, Horse, Race, RaceResult
+from scraper import NetKeibaError, NetKeibaScraper, build_http_session
+
+st.set_page_config(page_title='競馬AI予測システム', layout='wide')
+
+
+@st.cache_resource
+def init_tools():
+    db = DatabaseManager()
+    # HTTP接続はプロセスで1本のプール付きセッションを共有する
+    scraper = NetKeibaScraper(session=build_http_session())
+    analyzer = KeibaAnalyzer(db)
+    return db, scraper, analyzer
+
+
+db, scraper, analyzer = init_tools()
+
+
+# 集計クエリはDB状態の純関数なので、リラン（ウィジェット操作）のたびに
+# 再実行せず5分TTLでキャッシュする
+@st.cache_data(ttl=300)
+def load_dashboard_counts():
+    # 4本のCOUNT/MAXクエリを、スカラサブクエリの1文・1往復にまとめる
+    with db.session_scope() as session:
+        return session.execute(text(
+            'SELECT (SELECT COUNT(*) FROM races), '
+            '(SELECT COUNT(*) FROM horses), '
+            '(SELECT COUNT(*) FROM race_results), '
+            '(SELECT MAX(race_date) FROM races)'
+        )).one()
+
+
+@st.cache_data(ttl=300)
+def load_hot_horses(days, limit):
+    return analyzer.get_hot_horses(days=days, limit=limit)
+
+
+@st.cache_data(ttl=300)
+def load_return_rates(days):
+    # 3戦略を1回のスキャンでまとめて集計する
+    return analyzer.analyze_return_rates_bulk(days=days)
+
+
+# ドロップダウンはIDと表示名の2列だけを射影し、ORMオブジェクトを作らない
+@st.cache_data(ttl=300)
+def load_horse_options():
+    with db.session_scope() as session:
+        rows = session.execute(
+            select(Horse.horse_id, Horse.horse_name)).all()
+    return {horse_id: f'{horse_name} ({horse_id})'
+            for horse_id, horse_name in rows}
+
+
+@st.cache_data(ttl=300)
+def load_recent_race_options(limit=50):
+    with db.session_scope() as session:
+        rows = session.execute(
+            select(Race.race_id, Race.race_date, Race.race_name)
+            .order_by(Race.race_date.desc())
+            .limit(limit)
+        ).all()
+    return {race_id: f'{race_date} {race_name}'
+            for race_id, race_date, race_name in rows}
+
+
+# 図の構築も st.cache_data に載せる。plotly の Figure 生成は全列を
+# 走査してトレースを組み、Streamlit が毎回JSONへ再シリアライズするため、
+# データが変わらないリランでは丸ごとキャッシュから再送する
+@st.cache_data(ttl=300)
+def build_hot_horses_fig(hot_horses):
+    return px.bar(hot_horses, x='horse_name', y='score',
+                  title='スコア上位馬')
+
+
+@st.cache_data(ttl=300)
+def build_return_rate_fig(results, title):
+    fig = go.Figure(go.Bar(
+        x=results['strategy'],
+        y=results['return_rate'],
+        marker_color=np.where(results['return_rate'] > 100,
+                              'green', 'red'),
+    ))
+    fig.update_layout(title=title, yaxis_title='回収率')
+    return fig
+
+
+@st.cache_data(ttl=300)
+def build_profit_fig(results):
+    profit = results['returns'] - results['investment']
+    fig = go.Figure(go.Bar(
+        x=results['strategy'],
+        y=profit,
+        marker_color=np.where(profit > 0, 'green', 'red'),
+    ))
+    fig.update_layout(title='戦略別損益（円）')
+    return fig
+
+
+st.sidebar.title('競馬AI予測システム')
+page = st.sidebar.radio(
+    'メニュー',
+    ['ダッシュボード', 'データ収集', '馬情報分析', 'レース予測', '投資戦略分析'],
+)
+
+# --- ダッシュボード ---
+if page == 'ダッシュボード':
+    st.title('ダッシュボード')
+
+    if st.button('最新のデータに更新'):
+        st.cache_data.clear()
+
+    total_races, total_horses, total_results, recent_date = \
+        load_dashboard_counts()
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric('レース数', total_races)
+    col2.metric('登録馬数', total_horses)
+    col3.metric('結果レコード数', total_results)
+    col4.metric('最新レース日', str(recent_date) if recent_date else '-')
+
+    st.subheader('調子の良い馬 TOP10')
+    # 列指向dictのままArrow経由で表示し、dictのリストからの
+    # DataFrame構築（pandasの最遅パス）を踏まない
+    hot_horses = load_hot_horses(30, 10)
+    if hot_horses:
+        st.dataframe(pa.table(hot_horses))
+        st.plotly_chart(build_hot_horses_fig(hot_horses),
+                        use_container_width=True)
+    else:
+        st.info('データがありません。データ収集を実行してください。')
+
+    st.subheader('戦略別回収率（直近30日）')
+    rows = list(load_return_rates(30).values())
+    results = {key: np.asarray([r[key] for r in rows]) for key in rows[0]}
+    if results['bets'].sum() > 0:
+        st.plotly_chart(build_return_rate_fig(results, '回収率（%）'),
+                        use_container_width=True)
+
+# --- データ収集 ---
+elif page == 'データ収集':
+    st.title('データ収集')
+
+    target_date = st.date_input('取得する日付', datetime.now().date())
+    if st.button('データ取得開始'):
+        try:
+            races = scraper.get_race_list(target_date.strftime('%Y%m%d'))
+        except NetKeibaError as e:
+            st.error(f'レース一覧の取得に失敗しました: {e}')
+            races = []
+        if not races:
+            st.warning('レースが見つかりませんでした')
+        else:
+            st.info(f'{len(races)}件のレースが見つかりました')
+            progress = st.progress(0)
+
+            # 各レースの情報・結果・オッズは独立したHTTP GETなので、
+            # 逐次ではなくスレッドプールで並列に取得し、保存はループ後に
+            # 一括UPSERT/INSERTする
+            all_races = []
+            all_results = {}
+            all_odds = {}
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                futures = {}
+                for race in races:
+                    race_id = race['race_id']
+                    futures[executor.submit(
+                        scraper.get_race_info, race_id)] = ('info', race_id)
+                    futures[executor.submit(
+                        scraper.get_race_result_list, race_id)] = \
+                        ('result', race_id)
+                    futures[executor.submit(
+                        scraper.get_odds, race_id)] = ('odds', race_id)
+                failed = 0
+                for done, future in enumerate(as_completed(futures), 1):
+                    kind, race_id = futures[future]
+                    try:
+                        data = future.result()
+                    except NetKeibaError:
+                        failed += 1
+                        progress.progress(done / len(futures))
+                        continue
+                    if data:
+                        if kind == 'info':
+                            all_races.append(data)
+                        elif kind == 'result':
+                            all_results[race_id] = data
+                        else:
+                            all_odds[race_id] = data
+                    progress.progress(done / len(futures))
+
+                # 馬はレースをまたいで重複するので、一意なIDに絞って取得する
+                # to_dict('records') はリンクなし行でも horse_id キーを
+                # None で持つため、キーの有無ではなく値で絞る
+                horse_ids = {
+                    r['horse_id']
+                    for results in all_results.values()
+                    for r in results if r.get('horse_id')
+                }
+                # さらに既知の馬を除外する。日次の取り込みでは大半の馬が
+                # 登録済みなので、プロフィール取得はほぼ新馬だけになる
+                if horse_ids:
+                    with db.session_scope() as session:
+                        existing = set(session.execute(
+                            select(Horse.horse_id)
+                            .where(Horse.horse_id.in_(horse_ids))
+                        ).scalars())
+                    horse_ids -= existing
+                all_horses = []
+                horse_futures = [
+                    executor.submit(scraper.get_horse_info, horse_id)
+                    for horse_id in horse_ids
+                ]
+                for done, future in enumerate(as_completed(horse_futures), 1):
+                    try:
+                        horse_info = future.result()
+                    except NetKeibaError:
+                        failed += 1
+                        horse_info = None
+                    if horse_info:
+                        all_horses.append(horse_info)
+                    progress.progress(done / len(horse_futures))
+
+            db.save_races_bulk(all_races)
+            db.save_horses_bulk(all_horses)
+            for race_id, results in all_results.items():
+                db.save_race_results(race_id, results)
+            for race_id, odds in all_odds.items():
+                db.save_odds(race_id, odds)
+            st.success(
+                f'{len(all_races)}レース / {len(all_horses)}頭分の'
+                'データを保存しました')
+            if failed:
+                st.warning(f'{failed}件の取得に失敗しました（スキップ）')
+
+# --- 馬情報分析 ---
+elif page == '馬情報分析':
+    st.title('馬情報分析')
+
+    horse_options = load_horse_options()
+    if not horse_options:
+        st.info('馬データがありません。データ収集を実行してください。')
+        selected = None
+    else:
+        selected = st.selectbox(
+            '馬を選択',
+            list(horse_options),
+            format_func=horse_options.get,
+        )
+    # 詳細表示中のクエリは1つのセッションスコープで賄う
+    if selected:
+        with db.session_scope() as session:
+            horse = session.get(Horse, selected)
+            # 全行をソートして先頭を取るのではなく、インデックスだけで
+            # 引ける MAX() をDBに計算させる
+            last_race_date = session.execute(
+                select(func.max(Race.race_date))
+                .join(RaceResult, RaceResult.race_id == Race.race_id)
+                .where(RaceResult.horse_id == selected)
+            ).scalar()
+
+            st.subheader(horse.horse_name)
+            info_cols = st.columns(4)
+            info_cols[0].write(f'生年月日: {horse.birth_date or "-"}')
+            info_cols[1].write(f'調教師: {horse.trainer or "-"}')
+            info_cols[2].write(f'馬主: {horse.owner or "-"}')
+            info_cols[3].write(
+                f'最終出走日: {last_race_date or "-"}')
+
+            stats = analyzer.calculate_win_rate(selected)
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric('出走数', stats['races'])
+            col2.metric('勝利数', stats['wins'])
+            col3.metric('勝率', f"{stats['win_rate']}%")
+            col4.metric('複勝率', f"{stats['top3_rate']}%")
+
+            st.subheader('馬場状態別成績')
+            track_stats = analyzer.analyze_track_condition(selected)
+            if track_stats:
+                cols = {'馬場状態': list(track_stats)}
+                for key in next(iter(track_stats.values())):
+                    cols[key] = np.asarray(
+                        [s[key] for s in track_stats.values()])
+                st.dataframe(pa.table(cols))
+
+            st.subheader('距離帯別成績')
+            distance_stats = analyzer.analyze_distance_performance(selected)
+            if distance_stats:
+                cols = {'距離帯': list(distance_stats)}
+                for key in next(iter(distance_stats.values())):
+                    cols[key] = np.asarray(
+                        [s[key] for s in distance_stats.values()])
+                st.dataframe(pa.table(cols))
+
+# --- レース予測 ---
+elif page == 'レース予測':
+    st.title('レース予測')
+
+    race_options = load_recent_race_options()
+    if not race_options:
+        st.info('レースデータがありません。データ収集を実行してください。')
+        selected_race = None
+    else:
+        selected_race = st.selectbox(
+            'レースを選択',
+            list(race_options),
+            format_func=race_options.get,
+        )
+    if selected_race and st.button('予測実行'):
+        predictions = analyzer.predict_race_result(selected_race)
+        if not predictions:
+            st.warning('このレースの出走データがありません')
+        else:
+            st.subheader('予測順位')
+            df_pred = pd.DataFrame(predictions)
+            st.dataframe(df_pred.head(10))
+
+            with db.session_scope() as session:
+                actual_results = session.scalars(
+                    select(RaceResult)
+                    .options(load_only(RaceResult.horse_id,
+                                       RaceResult.ranking))
+                    .where(RaceResult.race_id == selected_race)
+                ).all()
+
+                if actual_results:
+                    st.subheader('予測と実際の比較')
+                    # 予測ごとの線形探索（O(N^2)）を避けて辞書で引く
+                    by_horse = {r.horse_id: r for r in actual_results}
+                    comparison = []
+                    for pred in predictions[:5]:
+                        actual = by_horse.get(pred['horse_id'])
+                        if actual and actual.ranking:
+                            comparison.append({
+                                '馬名': pred['horse_name'],
+                                '予測スコア': pred['score'],
+                                '実際の着順': actual.ranking,
+                            })
+                    if comparison:
+                        st.dataframe(pd.DataFrame(comparison))
+
+# --- 投資戦略分析 ---
+elif page == '投資戦略分析':
+    st.title('投資戦略分析')
+
+    days = st.slider('分析期間（日）', 7, 90, 30)
+    strategy_names = {
+        'favorite': '1番人気',
+        'longshot': '大穴狙い',
+        'value': '妙味重視',
+    }
+    by_strategy = load_return_rates(days)
+    rows = [by_strategy[strategy] for strategy in strategy_names]
+    results = {key: np.asarray([r[key] for r in rows]) for key in rows[0]}
+    results['strategy'] = list(strategy_names.values())
+
+    st.dataframe(pa.table(results))
+
+    if results['bets'].sum() > 0:
+        st.plotly_chart(build_return_rate_fig(results, '戦略別回収率（%）'),
+                        use_container_width=True)
+        st.plotly_chart(build_profit_fig(results),
+                        use_container_width=True)
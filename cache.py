@@ -0,0 +1,82 @@
+"""Redisベースの分析結果キャッシュ
+
+馬別の集計はその馬の新しいレース結果が入ったときにしか変わらないため、
+日付粒度のキー（prefix:引数:当日）でRedisにJSONを置く。Redisが無い環境
+（ローカル開発など）では自動的に素通しになる。
+"""
+import functools
+import os
+from datetime import date
+
+import orjson
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0')
+
+_client = None
+_client_checked = False
+
+
+def get_client():
+    """接続済みRedisクライアントを返す（使えなければ None）"""
+    global _client, _client_checked
+    if _client_checked:
+        return _client
+    _client_checked = True
+    if redis is None:
+        return None
+    try:
+        client = redis.Redis.from_url(
+            REDIS_URL, socket_connect_timeout=0.5, socket_timeout=0.5)
+        client.ping()
+        _client = client
+    except Exception:
+        _client = None
+    return _client
+
+
+def redis_cached(prefix, ttl=86400):
+    """メソッドの戻り値を日付粒度キーでRedisにキャッシュするデコレータ"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            client = get_client()
+            if client is None:
+                return func(self, *args, **kwargs)
+            arg_key = ':'.join(str(a) for a in args) or '-'
+            key = f'{prefix}:{arg_key}:{date.today().isoformat()}'
+            try:
+                cached = client.get(key)
+                if cached is not None:
+                    return orjson.loads(cached)
+            except Exception:
+                return func(self, *args, **kwargs)
+            value = func(self, *args, **kwargs)
+            # 集計値には np.float64 などが混ざるため NumPy 対応で直列化する。
+            # dumps は try の外に置き、直列化できない値を黙って捨てない
+            payload = orjson.dumps(
+                value, option=orjson.OPT_SERIALIZE_NUMPY)
+            try:
+                client.setex(key, ttl, payload)
+            except redis.RedisError:
+                pass
+            return value
+        return wrapper
+    return decorator
+
+
+def invalidate_horse(horse_id):
+    """指定馬のキャッシュを破棄する（スクレイパの結果保存時に呼ぶ）"""
+    client = get_client()
+    if client is None or not horse_id:
+        return
+    try:
+        for prefix in ('track', 'distance'):
+            for key in client.scan_iter(match=f'{prefix}:{horse_id}:*'):
+                client.delete(key)
+    except Exception:
+        pass
@@ -0,0 +1,485 @@
+"""競馬データベースのモデル定義とセッション管理"""
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+import cache
+
+from sqlalchemy import (
+    Date,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    create_engine,
+    delete,
+    event,
+    text,
+)
+from sqlalchemy.orm import (
+    DeclarativeBase,
+    Mapped,
+    mapped_column,
+    relationship,
+    scoped_session,
+    sessionmaker,
+)
+
+
+class Base(DeclarativeBase):
+    """2.0スタイルの型付き宣言ベース
+
+    Mapped / mapped_column のディスクリプタは旧 declarative_base() より
+    属性アクセスが速く、インスタンスあたりのメモリも小さい。
+    """
+
+# 馬ごとのローリング集計を保持するマテリアライズドビュー（PostgreSQLのみ）。
+# calculate_win_rate などが毎回 race_results×races を再スキャンしないための
+# ロールアップテーブル。夜間に scripts/refresh_views.py で REFRESH する。
+HORSE_STATS_VIEWS = {'horse_stats_30d': 30, 'horse_stats_365d': 365}
+
+_HORSE_STATS_VIEW_SQL = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS {name} AS
+SELECT rr.horse_id,
+       COUNT(*)                        AS races,
+       SUM((rr.ranking = 1)::int)      AS wins,
+       SUM((rr.ranking <= 3)::int)     AS top3,
+       AVG(rr.ranking)                 AS avg_ranking
+FROM race_results rr
+JOIN races r ON r.race_id = rr.race_id
+WHERE r.race_date > now() - interval '{days} days'
+  AND rr.ranking IS NOT NULL
+GROUP BY rr.horse_id
+"""
+
+
+class Race(Base):
+    """レース基本情報"""
+    __tablename__ = 'races'
+
+    race_id: Mapped[str] = mapped_column(String(20), primary_key=True)
+    race_name: Mapped[Optional[str]] = mapped_column(String(100))
+    race_date: Mapped[Optional[date]] = mapped_column(Date)
+    track: Mapped[Optional[str]] = mapped_column(String(20))
+    race_number: Mapped[Optional[int]] = mapped_column(Integer)
+    distance: Mapped[Optional[int]] = mapped_column(Integer)
+    # 芝 / ダート
+    track_type: Mapped[Optional[str]] = mapped_column(String(10))
+    # 良 / 稍重 / 重 / 不良
+    track_condition: Mapped[Optional[str]] = mapped_column(String(10))
+    weather: Mapped[Optional[str]] = mapped_column(String(10))
+    grade: Mapped[Optional[str]] = mapped_column(String(10))
+
+    __table_args__ = (
+        Index('ix_races_race_date', 'race_date'),
+    )
+
+    results: Mapped[List['RaceResult']] = relationship(
+        back_populates='race')
+
+
+class Horse(Base):
+    """競走馬情報"""
+    __tablename__ = 'horses'
+
+    horse_id: Mapped[str] = mapped_column(String(20), primary_key=True)
+    horse_name: Mapped[Optional[str]] = mapped_column(String(50))
+    birth_date: Mapped[Optional[date]] = mapped_column(Date)
+    sex: Mapped[Optional[str]] = mapped_column(String(5))
+    trainer: Mapped[Optional[str]] = mapped_column(String(50))
+    owner: Mapped[Optional[str]] = mapped_column(String(50))
+    breeder: Mapped[Optional[str]] = mapped_column(String(50))
+
+
+class RaceResult(Base):
+    """レース結果（1着順 = 1行）"""
+    __tablename__ = 'race_results'
+
+    id: Mapped[int] = mapped_column(
+        Integer, primary_key=True, autoincrement=True)
+    race_id: Mapped[Optional[str]] = mapped_column(
+        String(20), ForeignKey('races.race_id'))
+    horse_id: Mapped[Optional[str]] = mapped_column(
+        String(20), ForeignKey('horses.horse_id'))
+    horse_name: Mapped[Optional[str]] = mapped_column(String(50))
+    horse_number: Mapped[Optional[int]] = mapped_column(Integer)
+    ranking: Mapped[Optional[int]] = mapped_column(Integer)
+    jockey: Mapped[Optional[str]] = mapped_column(String(50))
+    time: Mapped[Optional[str]] = mapped_column(String(10))
+    popularity: Mapped[Optional[int]] = mapped_column(Integer)
+    odds: Mapped[Optional[float]] = mapped_column(Float)
+    horse_weight: Mapped[Optional[str]] = mapped_column(String(10))
+
+    # アナライザの頻出述語に合わせた複合インデックス:
+    #   horse_id + id DESC … 馬別の直近成績（predict の窓関数）
+    #   race_id + popularity … 回収率分析の買い目選定
+    #   jockey … 騎手別集計
+    __table_args__ = (
+        Index('ix_results_horse_id_id', 'horse_id', 'id'),
+        Index('ix_results_race_popularity', 'race_id', 'popularity'),
+        Index('ix_results_jockey', 'jockey'),
+    )
+
+    race: Mapped[Optional['Race']] = relationship(
+        back_populates='results')
+    horse: Mapped[Optional['Horse']] = relationship()
+
+
+class Odds(Base):
+    """オッズ情報"""
+    __tablename__ = 'odds'
+
+    id: Mapped[int] = mapped_column(
+        Integer, primary_key=True, autoincrement=True)
+    race_id: Mapped[Optional[str]] = mapped_column(
+        String(20), ForeignKey('races.race_id'))
+    # 単勝 / 複勝 など
+    odds_type: Mapped[Optional[str]] = mapped_column(String(10))
+    horse_number: Mapped[Optional[int]] = mapped_column(Integer)
+    odds_value: Mapped[Optional[float]] = mapped_column(Float)
+    updated_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime, default=datetime.now)
+
+    __table_args__ = (
+        Index('ix_odds_race_type', 'race_id', 'odds_type'),
+    )
+
+
+class HotHorseDaily(Base):
+    """「調子の良い馬」の読み出し用ロールアップ
+
+    get_hot_horses を読み出しのたびに再集計しない。スクレイパが結果を
+    保存したタイミングで upsert_hot_horses() が出走馬だけ差分更新し、
+    読み側は ORDER BY score DESC LIMIT n だけで済む。
+    """
+    __tablename__ = 'hot_horses_daily'
+
+    horse_id: Mapped[str] = mapped_column(String(20), primary_key=True)
+    horse_name: Mapped[Optional[str]] = mapped_column(String(50))
+    races: Mapped[Optional[int]] = mapped_column(Integer)
+    wins: Mapped[Optional[int]] = mapped_column(Integer)
+    top3: Mapped[Optional[int]] = mapped_column(Integer)
+    avg_ranking: Mapped[Optional[float]] = mapped_column(Float)
+    score: Mapped[Optional[float]] = mapped_column(Float)
+    computed_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime, default=datetime.now)
+
+    __table_args__ = (
+        Index('ix_hot_horses_daily_score', 'score'),
+    )
+
+
+class DatabaseManager:
+    """DB接続とレコード保存をまとめるヘルパー"""
+
+    def __init__(self, db_url='sqlite:///keiba_data.db'):
+        # コンパイル済みSQLのキャッシュを広めに取り、接続プールを常備する。
+        # pre_ping は使わない（余計な往復を増やすだけの構成）
+        engine_kwargs = {
+            'query_cache_size': 1200,
+            'pool_size': 10,
+            'max_overflow': 20,
+            'pool_pre_ping': False,
+        }
+        if db_url.startswith('sqlite'):
+            # Streamlit は別スレッドからリランするため必須
+            engine_kwargs['connect_args'] = {'check_same_thread': False}
+        self.engine = create_engine(db_url, **engine_kwargs)
+        if self.engine.dialect.name == 'sqlite':
+            event.listen(self.engine, 'connect', self._set_sqlite_pragmas)
+        Base.metadata.create_all(self.engine)
+        # create_all は既存テーブルへ後から増えたインデックスを作らないため、
+        # 明示的に CREATE INDEX IF NOT EXISTS 相当を流す
+        for table in Base.metadata.tables.values():
+            for index in table.indexes:
+                index.create(self.engine, checkfirst=True)
+        self.SessionLocal = sessionmaker(bind=self.engine)
+        # スレッド単位でセッションを再利用するレジストリ。ワーカー内では
+        # 毎回の open/close ではなく、リクエスト終了時に remove() する
+        self.Session = scoped_session(self.SessionLocal)
+        self.has_horse_stats_views = self.engine.dialect.name == 'postgresql'
+        if self.has_horse_stats_views:
+            self.create_horse_stats_views()
+
+    @staticmethod
+    def _set_sqlite_pragmas(dbapi_conn, connection_record):
+        """接続ごとにSQLiteの書き込み性能系PRAGMAを設定する
+
+        WAL + synchronous=NORMAL でコミットごとの fsync を減らし、
+        一時表とページキャッシュをメモリに寄せ、mmap で読み取りを速くする。
+        """
+        cursor = dbapi_conn.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA mmap_size=268435456')   # 256MB
+        cursor.execute('PRAGMA cache_size=-65536')     # 64MB
+        cursor.close()
+
+    def get_session(self):
+        return self.Session()
+
+    @contextmanager
+    def session_scope(self):
+        """1ページ描画（または1処理）ぶんのクエリを束ねるスコープ
+
+        ページ内の複数クエリで接続のチェックアウトとアイデンティティ
+        マップを共有し、終了時に commit / rollback / close をまとめる。
+        """
+        session = self.get_session()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def remove_session(self):
+        """現在のスレッドに紐づくセッションを破棄する（teardown用）"""
+        self.Session.remove()
+
+    def create_horse_stats_views(self):
+        """馬別ローリング集計のマテリアライズドビューを作成する"""
+        with self.engine.begin() as conn:
+            for name, days in HORSE_STATS_VIEWS.items():
+                conn.execute(text(
+                    _HORSE_STATS_VIEW_SQL.format(name=name, days=days)))
+                # CONCURRENTLY な REFRESH にはユニークインデックスが必須
+                conn.execute(text(
+                    f'CREATE UNIQUE INDEX IF NOT EXISTS ix_{name}_horse_id '
+                    f'ON {name} (horse_id)'))
+
+    def refresh_horse_stats_views(self):
+        """マテリアライズドビューを最新化する（夜間cron向け）"""
+        if not self.has_horse_stats_views:
+            return
+        with self.engine.begin() as conn:
+            for name in HORSE_STATS_VIEWS:
+                conn.execute(text(
+                    f'REFRESH MATERIALIZED VIEW CONCURRENTLY {name}'))
+
+    def _bulk_upsert(self, table, rows, key, batch_size=1000):
+        """executemany の UPSERT を1トランザクションで発行する
+
+        行ごとの session.merge()（SELECT+INSERT/UPDATE × コミット）を、
+        方言別の INSERT ... ON CONFLICT DO UPDATE にまとめる。
+        """
+        if not rows:
+            return True
+        if self.engine.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+
+        # executemany は全行同じキー構成が前提なので、テーブル列に正規化し、
+        # 同一キーが同バッチに並ばないよう後勝ちで重複排除する
+        columns = [c.name for c in table.columns]
+        normalized = ({c: row.get(c) for c in columns}
+                      for row in rows if row.get(key))
+        deduped = list({row[key]: row for row in normalized}.values())
+        try:
+            with self.engine.begin() as conn:
+                for start in range(0, len(deduped), batch_size):
+                    batch = deduped[start:start + batch_size]
+                    stmt = insert(table).values(batch)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[key],
+                        set_={c.name: getattr(stmt.excluded, c.name)
+                              for c in table.columns if c.name != key},
+                    )
+                    conn.execute(stmt)
+            return True
+        except Exception as e:
+            print(f"一括保存エラー({table.name}): {e}")
+            return False
+
+    def save_races_bulk(self, races):
+        """レース情報をまとめてUPSERTする"""
+        return self._bulk_upsert(Race.__table__, races, 'race_id')
+
+    def save_horses_bulk(self, horses):
+        """馬情報をまとめてUPSERTする"""
+        return self._bulk_upsert(Horse.__table__, horses, 'horse_id')
+
+    def save_race(self, race_info):
+        """レース情報を保存（既存なら更新）"""
+        return self.save_races_bulk([race_info])
+
+    def save_horse(self, horse_info):
+        """馬情報を保存（既存なら更新）"""
+        return self.save_horses_bulk([horse_info])
+
+    # COPY / executemany で流し込む race_results の列
+    _RESULT_COLUMNS = ('race_id', 'horse_id', 'horse_name', 'horse_number',
+                       'ranking', 'jockey', 'time', 'popularity', 'odds',
+                       'horse_weight')
+
+    def save_race_results(self, race_id, results):
+        """レース結果を保存（同一レースは入れ替え・一括INSERT）"""
+        rows = [
+            {col: (race_id if col == 'race_id' else result_data.get(col))
+             for col in self._RESULT_COLUMNS}
+            for result_data in results
+        ]
+        try:
+            # DELETE と INSERT は同一トランザクションで行う
+            with self.engine.begin() as conn:
+                conn.execute(
+                    RaceResult.__table__.delete()
+                    .where(RaceResult.__table__.c.race_id == race_id))
+                if rows:
+                    if self.engine.dialect.name == 'postgresql':
+                        self._copy_rows(conn, 'race_results',
+                                        self._RESULT_COLUMNS, rows)
+                    else:
+                        conn.execute(RaceResult.__table__.insert(), rows)
+            # 成績が変わった馬のRedisキャッシュを落とす
+            horse_ids = {r.get('horse_id') for r in results}
+            for horse_id in horse_ids:
+                cache.invalidate_horse(horse_id)
+            # 書き込み時にロールアップを更新し、読み出しを索引一発にする。
+            # 全件の作り直しではなく、このレースに出た馬だけ差分更新する
+            self.upsert_hot_horses(horse_ids)
+            return True
+        except Exception as e:
+            print(f"レース結果保存エラー: {e}")
+            return False
+
+    @staticmethod
+    def _copy_rows(conn, table_name, columns, rows):
+        """psycopg2 の COPY FROM でTSVバッファを流し込む（PostgreSQL専用）"""
+        import csv
+        import io
+
+        buf = io.StringIO()
+        writer = csv.writer(buf, delimiter='\t', lineterminator='\n')
+        for row in rows:
+            writer.writerow(
+                ['\\N' if row[c] is None else row[c] for c in columns])
+        buf.seek(0)
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_from(buf, table_name, columns=columns,
+                             sep='\t', null='\\N')
+        finally:
+            cursor.close()
+
+    def _compute_hot_horse_rows(self, session, days, horse_ids=None):
+        """hot_horses_daily 向けの集計行を組み立てる
+
+        horse_ids を渡すとその馬だけに絞った差分集計になる。行ごとの
+        ORMインスタンス生成＋unit-of-workを通さず、Core の executemany
+        で流し込める dict のリストを返す。
+        """
+        from sqlalchemy import case, func, select
+
+        cutoff_date = datetime.now().date() - timedelta(days=days)
+        wins = func.sum(case((RaceResult.ranking == 1, 1), else_=0))
+        top3 = func.sum(case((RaceResult.ranking <= 3, 1), else_=0))
+        races = func.count()
+        avg_ranking = func.avg(RaceResult.ranking)
+        stmt = (
+            select(
+                RaceResult.horse_id,
+                func.max(Horse.horse_name),
+                races,
+                wins,
+                top3,
+                avg_ranking,
+            )
+            .select_from(RaceResult)
+            .join(Horse, RaceResult.horse_id == Horse.horse_id)
+            .join(Race, RaceResult.race_id == Race.race_id)
+            .where(
+                Race.race_date >= cutoff_date,
+                RaceResult.ranking.isnot(None),
+            )
+            .group_by(RaceResult.horse_id)
+            .having(races >= 2)
+        )
+        if horse_ids is not None:
+            stmt = stmt.where(RaceResult.horse_id.in_(horse_ids))
+
+        computed_at = datetime.now()
+        inserts = []
+        for horse_id, horse_name, n, w, t3, avg in session.execute(stmt):
+            avg = float(avg)
+            inserts.append({
+                'horse_id': horse_id,
+                'horse_name': horse_name,
+                'races': n,
+                'wins': int(w),
+                'top3': int(t3),
+                'avg_ranking': round(avg, 2),
+                'score': round(
+                    w / n * 300 + t3 / n * 200 + (20 - avg) * 5, 1),
+                'computed_at': computed_at,
+            })
+        return inserts
+
+    def upsert_hot_horses(self, horse_ids, days=30):
+        """指定した馬だけ hot_horses_daily を差分更新する（結果保存時）
+
+        保存のたびに全馬30日分を作り直すと取り込み1巡で
+        O(レース数×窓) になるため、そのレースに出た馬だけ再集計して
+        入れ替える。集計対象から外れた馬（直近2走未満）は行ごと消える。
+        """
+        horse_ids = {h for h in horse_ids if h}
+        if not horse_ids:
+            return True
+        session = self.get_session()
+        try:
+            inserts = self._compute_hot_horse_rows(
+                session, days, horse_ids=horse_ids)
+            session.execute(
+                delete(HotHorseDaily)
+                .where(HotHorseDaily.horse_id.in_(horse_ids)))
+            if inserts:
+                session.execute(HotHorseDaily.__table__.insert(), inserts)
+            session.commit()
+            return True
+        except Exception as e:
+            session.rollback()
+            print(f"ロールアップ更新エラー: {e}")
+            return False
+
+    def refresh_hot_horses_daily(self, days=30):
+        """hot_horses_daily ロールアップを全件作り直す（夜間・初期整備用）"""
+        session = self.get_session()
+        try:
+            inserts = self._compute_hot_horse_rows(session, days)
+            session.execute(delete(HotHorseDaily))
+            if inserts:
+                session.execute(HotHorseDaily.__table__.insert(), inserts)
+            session.commit()
+            return True
+        except Exception as e:
+            session.rollback()
+            print(f"ロールアップ更新エラー: {e}")
+            return False
+
+    def save_odds(self, race_id, odds_info):
+        """オッズ情報を保存（同一レースは入れ替え・一括INSERT）"""
+        updated_at = datetime.now()
+        rows = [
+            {'race_id': race_id, 'odds_type': odds_type,
+             'horse_number': horse_number, 'odds_value': odds_value,
+             'updated_at': updated_at}
+            for odds_type, values in odds_info.items()
+            for horse_number, odds_value in values.items()
+        ]
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(
+                    Odds.__table__.delete()
+                    .where(Odds.__table__.c.race_id == race_id))
+                if rows:
+                    conn.execute(Odds.__table__.insert(), rows)
+            return True
+        except Exception as e:
+            print(f"オッズ保存エラー: {e}")
+            return False
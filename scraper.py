@@ -0,0 +1,584 @@
+"""netkeiba.com からレース・馬・オッズ情報を取得するスクレイパ"""
+import asyncio
+import logging
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import aiohttp
+import pandas as pd
+import requests
+from bs4 import BeautifulSoup, SoupStrainer
+from lxml import html as lxml_html
+from lxml.etree import XPath
+from requests.adapters import HTTPAdapter
+from requests_cache import CachedSession
+from selectolax.parser import HTMLParser
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError:  # opt-in の HTTP/2 経路。無ければ requests のみ
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# _get() が NetKeibaError に包むネットワーク例外。セッションには
+# requests 系（CachedSession）も httpx.Client も差し込めるため、
+# インストールされていれば両系統を拾う
+if httpx is not None:
+    _NETWORK_ERRORS = (requests.RequestException, httpx.HTTPError)
+else:
+    _NETWORK_ERRORS = (requests.RequestException,)
+
+
+class NetKeibaError(Exception):
+    """netkeiba からの取得がリトライ込みで失敗したときに送出する
+
+    ネットワーク起因の失敗だけをこの型に包む。パース側のバグは
+    握りつぶさず素の例外のまま上げる（空の結果を返してしまうと
+    「取れなかった」と「いなかった」が区別できなくなる）。
+    """
+
+
+def build_http_session():
+    """接続プール・リトライ・ディスクキャッシュ付きのセッションを作る
+
+    プールを持たないセッションは リクエストごとに TCP+TLS ハンドシェイク
+    （~100ms）を払う。プール済みコネクションの再利用と gzip 転送で、
+    同一ホストへの連続アクセスを大幅に短縮する。
+
+    さらに確定済みレース・馬ページは事実上不変なので、
+    requests-cache の SQLite バックエンドでURL単位にキャッシュし、
+    再実行時はネットワークに出ずディスク読みで返す。オッズだけは
+    レース当日に動くため30秒で失効させる。
+    """
+    # cache_control=True で ETag / Last-Modified を保存し、TTL切れの
+    # 再取得は If-None-Match / If-Modified-Since 付きの条件付きGETになる。
+    # 変わっていないページは 304（ヘッダのみ）で済み、本文の再転送も
+    # 再パースも発生しない
+    session = CachedSession(
+        'netkeiba_cache',
+        backend='sqlite',
+        cache_control=True,
+        expire_after=timedelta(days=30),
+        urls_expire_after={
+            '*/odds/*': 30,
+            '*/race/list/*': 3600,
+            '*/race/*': timedelta(days=365),
+        },
+    )
+    # 並列取得（ThreadPoolExecutor 8本）でもプールが溢れて keep-alive を
+    # 落とさない大きさにし、429/5xx は指数バックオフで退避する
+    # 429 はアダプタ層で再試行せず、_get() が Retry-After を見て退避する
+    retry = Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=['GET'],
+    )
+    adapter = HTTPAdapter(
+        pool_connections=64,
+        pool_maxsize=64,
+        max_retries=retry,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(_DEFAULT_HEADERS)
+    return session
+
+
+def build_http2_session():
+    """HTTP/2 多重化を使う httpx.Client を作る（opt-in）
+
+    HTTP/1.1 はコネクション内でリクエストが直列になるが、HTTP/2 なら
+    1本のTLSセッション上で複数GETを独立ストリームとして多重化できる。
+    requests-cache のディスクキャッシュとは併用できないため、既定には
+    せず、キャッシュより同時実行数を優先したいバッチ向けの差し替え用:
+    NetKeibaScraper(session=build_http2_session())
+    （httpx の .get/.status_code/.content は requests と互換）
+    """
+    if httpx is None:
+        raise ImportError(
+            'httpx が見つかりません（pip install "httpx[http2]"）')
+    return httpx.Client(
+        http2=True,
+        headers=_DEFAULT_HEADERS,
+        limits=httpx.Limits(
+            max_keepalive_connections=32,
+            max_connections=64,
+        ),
+        timeout=10.0,
+        follow_redirects=True,
+    )
+
+
+# 行・リンク単位のホットループで毎回 re.compile（とパターンキャッシュの
+# 辞書参照）を踏まないよう、モジュールロード時に一度だけコンパイルする
+_RACE_HREF_RE = re.compile(r'/race/(\d+)')
+_HORSE_HREF_RE = re.compile(r'/horse/(\d+)')
+_DISTANCE_RE = re.compile(r'(芝|ダ|障)[^0-9]*(\d+)m')
+_WEATHER_RE = re.compile(r'天候\s*:\s*(\S+)')
+_CONDITION_RE = re.compile(r'馬場\s*:\s*(\S+)')
+_DATE_RE = re.compile(r'(\d{4})年(\d{1,2})月(\d{1,2})日')
+
+# bs4 のパースは必要なサブツリーに絞る。ストレイナ外のノードは
+# Pythonオブジェクト化されないため、ページの大半を捨てられる
+_RACE_LINK_STRAINER = SoupStrainer('a', href=_RACE_HREF_RE)
+_HORSE_PROF_STRAINER = SoupStrainer(['h1', 'table'])
+
+# XPath式も正規表現同様、素の .xpath('...') は呼び出しごとに再コンパイル
+# されるため、モジュールロード時に XPath オブジェクトへ固めておく
+_XP_RESULT_ROWS = XPath(
+    '//table[contains(@class, "RaceTable01") or '
+    'contains(@class, "race_table_01")]//tr[position() > 1]')
+_XP_ROW_CELLS = XPath('./td')
+_XP_HORSE_HREF = XPath('./td[4]//a/@href')
+
+# get_race_result が返す DataFrame の列（＝従来の dict キー順）
+_RESULT_FRAME_COLUMNS = ('ranking', 'horse_number', 'horse_name', 'horse_id',
+                         'jockey', 'time', 'odds', 'popularity',
+                         'horse_weight')
+
+# プロフィール表の見出し→属性名。netkeiba の th は定型文字列なので、
+# 行ごとの substring 判定チェーンではなく辞書1回引きで振り分ける
+_HORSE_KEYMAP = {
+    '生年月日': 'birth_date',
+    '調教師': 'trainer',
+    '馬主': 'owner',
+    '生産者': 'breeder',
+}
+
+_DEFAULT_HEADERS = {
+    'User-Agent': ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
+                   'AppleWebKit/537.36 (KHTML, like Gecko) '
+                   'Chrome/120.0.0.0 Safari/537.36'),
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+}
+
+
+class NetKeibaScraper:
+    """netkeiba のDBページをスクレイピングする
+
+    取得（HTTP GET）とパースを分け、パースは _parse_* の静的メソッドに
+    まとめてある。AsyncNetKeibaScraper も同じパース関数を使う。
+    """
+
+    def __init__(self, session=None):
+        self.base_url = 'https://db.netkeiba.com'
+        self.session = session if session is not None else \
+            build_http_session()
+        # get_race_info と get_race_result は同じ /race/{id}/ を見るため、
+        # 取得だけでなくパース済みの lxml ツリーごと race_id 単位で共有
+        # する。本文バイト列のメモ化では fromstring が呼び出し側ごとに
+        # 走ってしまうため、パースも1回で済ませる
+        self._doc_cache = OrderedDict()
+        self._doc_lock = threading.Lock()
+        # 並列呼び出し時でもサーバへの同時リクエスト数を絞る
+        self._gate = threading.Semaphore(8)
+
+    # パース済みツリーは本文バイト列より一桁大きいため、保持数は
+    # 控えめにして LRU で押し出す（バッチ1巡で十分回る大きさ）
+    _DOC_CACHE_SIZE = 64
+
+    def _race_doc(self, race_id):
+        """レースページのパース済み lxml ツリーを返す（LRUメモ化）"""
+        with self._doc_lock:
+            doc = self._doc_cache.get(race_id)
+            if doc is not None:
+                self._doc_cache.move_to_end(race_id)
+                return doc
+        content = self._get(f'{self.base_url}/race/{race_id}/')
+        doc = lxml_html.fromstring(content)
+        with self._doc_lock:
+            self._doc_cache[race_id] = doc
+            self._doc_cache.move_to_end(race_id)
+            while len(self._doc_cache) > self._DOC_CACHE_SIZE:
+                self._doc_cache.popitem(last=False)
+        return doc
+
+    def _get(self, url, max_retries=5):
+        """1ページ取得して本文を返す
+
+        429 が返ったら Retry-After（無ければジッタ付き指数バックオフ）
+        だけ待って再試行する。素通しの再試行でレート制限を深掘りして
+        全体を巻き込むより、待つ方が持続スループットは高い。
+
+        アダプタ層のリトライを使い切ってもなお失敗したネットワーク
+        エラーは NetKeibaError に包んで上げる。ここ以外は例外を
+        捕まえない（パースのバグを空結果で隠さないため）。
+        """
+        for attempt in range(max_retries):
+            try:
+                with self._gate:
+                    response = self.session.get(url, timeout=10)
+                if (response.status_code == 429
+                        and attempt < max_retries - 1):
+                    retry_after = response.headers.get('Retry-After')
+                    try:
+                        wait = float(retry_after)
+                    except (TypeError, ValueError):
+                        wait = 0.5 * 2 ** attempt + random.random()
+                    time.sleep(min(60.0, wait))
+                    continue
+                response.raise_for_status()
+            except _NETWORK_ERRORS as e:
+                raise NetKeibaError(f'取得に失敗しました: {url}') from e
+            # キャッシュヒットはサーバに触れていないため礼儀スリープ不要
+            if not getattr(response, 'from_cache', False):
+                time.sleep(1)
+            return response.content
+
+    def get_race_list(self, date_str):
+        """指定日のレース一覧を取得する（date_str: YYYYMMDD）"""
+        content = self._get(f'{self.base_url}/race/list/{date_str}/')
+        return self._parse_race_list(content)
+
+    def get_race_info(self, race_id):
+        """レースの基本情報を取得する"""
+        return self._extract_race_info(self._race_doc(race_id), race_id)
+
+    def get_race_result(self, race_id):
+        """レース結果（全着順）を列指向の DataFrame で取得する"""
+        return self._extract_race_result(self._race_doc(race_id))
+
+    def get_race_result_list(self, race_id):
+        """従来形式（1着順 = 1 dict のリスト）で結果を返す互換ラッパ"""
+        df = self.get_race_result(race_id)
+        if df.empty:
+            return []
+        return df.astype(object).where(df.notna(), None).to_dict('records')
+
+    def get_horse_info(self, horse_id):
+        """馬のプロフィール情報を取得する"""
+        content = self._get(f'{self.base_url}/horse/{horse_id}/')
+        return self._parse_horse_info(content, horse_id)
+
+    def get_horses_bulk(self, horse_ids, max_workers=16):
+        """複数頭のプロフィールを重複排除して並列に取得する
+
+        集約レイヤなので、取得に失敗した馬はログを残して飛ばし、
+        取れた分だけ返す。
+        """
+        unique_ids = list(dict.fromkeys(horse_ids))
+
+        def fetch(horse_id):
+            try:
+                return self.get_horse_info(horse_id)
+            except NetKeibaError:
+                logger.exception('馬情報の取得に失敗: %s', horse_id)
+                return None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            infos = executor.map(fetch, unique_ids)
+        return [info for info in infos if info]
+
+    def get_odds(self, race_id):
+        """単勝オッズを取得する"""
+        content = self._get(
+            'https://race.netkeiba.com/odds/index.html'
+            f'?race_id={race_id}')
+        return self._parse_odds(content)
+
+    @staticmethod
+    def _parse_race_list(content):
+        soup = BeautifulSoup(content, 'lxml',
+                             parse_only=_RACE_LINK_STRAINER)
+        races = []
+        seen = set()
+        for link in soup.find_all('a', href=_RACE_HREF_RE):
+            match = _RACE_HREF_RE.search(link['href'])
+            if not match:
+                continue
+            race_id = match.group(1)
+            if race_id in seen:
+                continue
+            seen.add(race_id)
+            races.append({
+                'race_id': race_id,
+                'race_name': link.get_text(strip=True),
+            })
+        return races
+
+    @staticmethod
+    def _parse_race_info(content, race_id):
+        return NetKeibaScraper._extract_race_info(
+            lxml_html.fromstring(content), race_id)
+
+    @staticmethod
+    def _extract_race_info(doc, race_id):
+        # _extract_race_result と同じパース済みツリーから抜き出すため、
+        # /race/{id}/ のパースは info・result あわせて1回で済む。
+        # ページ全文から開催日も拾うのでサブツリーには絞らない
+        race_info = {'race_id': race_id}
+
+        h1 = doc.find('.//h1')
+        if h1 is not None:
+            race_info['race_name'] = ' '.join(h1.text_content().split())
+
+        data_intro = doc.xpath('//div[contains(@class, "data_intro")]')
+        if data_intro:
+            text = data_intro[0].text_content()
+            distance_match = _DISTANCE_RE.search(text)
+            if distance_match:
+                track_types = {'芝': '芝', 'ダ': 'ダート', '障': '障害'}
+                race_info['track_type'] = track_types[distance_match.group(1)]
+                race_info['distance'] = int(distance_match.group(2))
+            weather_match = _WEATHER_RE.search(text)
+            if weather_match:
+                race_info['weather'] = weather_match.group(1)
+            condition_match = _CONDITION_RE.search(text)
+            if condition_match:
+                race_info['track_condition'] = condition_match.group(1)
+
+        date_match = _DATE_RE.search(doc.text_content())
+        if date_match:
+            race_info['race_date'] = datetime(
+                int(date_match.group(1)),
+                int(date_match.group(2)),
+                int(date_match.group(3)),
+            ).date()
+        return race_info
+
+    @staticmethod
+    def _parse_race_result(content):
+        return NetKeibaScraper._extract_race_result(
+            lxml_html.fromstring(content))
+
+    @staticmethod
+    def _extract_race_result(doc):
+        # 行ごとのセル集合・リンクを XPath の1パスでC側から取り出し、
+        # Python⇔Cの往復をセル単位から行単位まで減らす
+        rows = _XP_RESULT_ROWS(doc)
+
+        records = []
+        for tr in rows:
+            cols = _XP_ROW_CELLS(tr)
+            if len(cols) < 11:
+                continue
+            texts = [' '.join(c.text_content().split()) for c in cols]
+            hrefs = _XP_HORSE_HREF(tr)
+            records.append((texts, hrefs[0] if hrefs else ''))
+        if not records:
+            return pd.DataFrame(columns=list(_RESULT_FRAME_COLUMNS))
+
+        def col(i):
+            return [t[i] if len(t) > i else None for t, _ in records]
+
+        def int_col(i):
+            # to_numeric はリスト入力だと ndarray を返し、ndarray.astype は
+            # pandas拡張dtypeの 'Int64' を解さないため pd.array で包む
+            return pd.array(pd.to_numeric(col(i), errors='coerce'),
+                            dtype='Int64')
+
+        # 行ごとの int()/float() + try/except ではなく、列単位の
+        # pd.to_numeric(errors='coerce') でまとめて数値化する（SoA）
+        return pd.DataFrame({
+            'ranking': int_col(0),
+            'horse_number': int_col(2),
+            'horse_name': col(3),
+            'horse_id': [m.group(1) if (m := _HORSE_HREF_RE.search(h))
+                         else None for _, h in records],
+            'jockey': col(6),
+            'time': col(7),
+            'odds': pd.to_numeric(col(12), errors='coerce'),
+            'popularity': int_col(13),
+            'horse_weight': col(14),
+        })
+
+    @staticmethod
+    def _parse_horse_info(content, horse_id):
+        soup = BeautifulSoup(content, 'lxml',
+                             parse_only=_HORSE_PROF_STRAINER)
+        horse_info = {'horse_id': horse_id}
+
+        h1 = soup.find('h1')
+        if h1:
+            horse_info['horse_name'] = h1.get_text(strip=True)
+
+        prof_table = soup.find('table', class_='db_prof_table')
+        if prof_table:
+            for row in prof_table.find_all('tr'):
+                th = row.find('th')
+                td = row.find('td')
+                if not (th and td):
+                    continue
+                field = _HORSE_KEYMAP.get(th.get_text(strip=True))
+                if field is None:
+                    continue
+                value = td.get_text(strip=True)
+                if field == 'birth_date':
+                    birth_match = _DATE_RE.search(value)
+                    if birth_match:
+                        horse_info['birth_date'] = datetime(
+                            int(birth_match.group(1)),
+                            int(birth_match.group(2)),
+                            int(birth_match.group(3)),
+                        ).date()
+                else:
+                    horse_info[field] = value
+        return horse_info
+
+    @staticmethod
+    def _parse_odds(content):
+        tree = HTMLParser(content)
+        rows = tree.css('table#odds_tan_block tr')
+        if not rows:
+            return {}
+
+        tan_odds = {}
+        for row in rows[1:]:
+            cols = row.css('td')
+            if len(cols) < 2:
+                continue
+            try:
+                horse_number = int(cols[0].text(strip=True))
+                odds_value = float(cols[-1].text(strip=True))
+            except ValueError:
+                continue
+            tan_odds[horse_number] = odds_value
+        return {'単勝': tan_odds}
+
+
+class AsyncNetKeibaScraper:
+    """aiohttp で並行取得する非同期版スクレイパ
+
+    I/Oバウンドな取得だけを asyncio に載せ、パースは NetKeibaScraper の
+    _parse_* をそのまま使う。同時接続は Semaphore で絞る。
+
+    使い方:
+        async with AsyncNetKeibaScraper() as scraper:
+            results = await scraper.get_races_bulk(race_ids)
+    """
+
+    def __init__(self, concurrency=64):
+        self.base_url = 'https://db.netkeiba.com'
+        self._concurrency = concurrency
+        self._session = None
+        self._semaphore = None
+        self._parse_pool = None
+
+    async def __aenter__(self):
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit_per_host=self._concurrency,
+                keepalive_timeout=85,
+            ),
+            headers=_DEFAULT_HEADERS,
+            timeout=aiohttp.ClientTimeout(total=10),
+        )
+        self._semaphore = asyncio.Semaphore(self._concurrency)
+        # 結果表のパースはCPUバウンドで、イベントループ上で実行すると
+        # その間ほかのGETの応答処理が止まる。スレッドプールに逃がせば
+        # ループはI/Oに専念でき、lxml はパース中GILを離すので
+        # ThreadPoolExecutor でも実効的に並列になる
+        self._parse_pool = ThreadPoolExecutor(
+            max_workers=4, thread_name_prefix='parse')
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._session.close()
+        self._parse_pool.shutdown(wait=True)
+
+    async def _parse_off_loop(self, parse, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._parse_pool, parse, *args)
+
+    async def _get(self, url, max_retries=5):
+        async with self._semaphore:
+            for attempt in range(max_retries):
+                try:
+                    async with self._session.get(url) as response:
+                        if (response.status == 429
+                                and attempt < max_retries - 1):
+                            retry_after = \
+                                response.headers.get('Retry-After')
+                            try:
+                                wait = float(retry_after)
+                            except (TypeError, ValueError):
+                                wait = 0.5 * 2 ** attempt + random.random()
+                            await asyncio.sleep(min(60.0, wait))
+                            continue
+                        response.raise_for_status()
+                        return await response.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    if attempt >= max_retries - 1:
+                        raise NetKeibaError(
+                            f'取得に失敗しました: {url}') from e
+                    await asyncio.sleep(
+                        0.5 * 2 ** attempt + random.random())
+
+    async def get_race_list(self, date_str):
+        """指定日のレース一覧を取得する（date_str: YYYYMMDD）"""
+        content = await self._get(f'{self.base_url}/race/list/{date_str}/')
+        return NetKeibaScraper._parse_race_list(content)
+
+    async def get_race_info(self, race_id):
+        """レースの基本情報を取得する"""
+        content = await self._get(f'{self.base_url}/race/{race_id}/')
+        return await self._parse_off_loop(
+            NetKeibaScraper._parse_race_info, content, race_id)
+
+    async def get_race_result(self, race_id):
+        """レース結果（全着順）を列指向の DataFrame で取得する"""
+        content = await self._get(f'{self.base_url}/race/{race_id}/')
+        return await self._parse_off_loop(
+            NetKeibaScraper._parse_race_result, content)
+
+    async def get_horse_info(self, horse_id):
+        """馬のプロフィール情報を取得する"""
+        content = await self._get(f'{self.base_url}/horse/{horse_id}/')
+        return NetKeibaScraper._parse_horse_info(content, horse_id)
+
+    async def get_odds(self, race_id):
+        """単勝オッズを取得する"""
+        content = await self._get(
+            'https://race.netkeiba.com/odds/index.html'
+            f'?race_id={race_id}')
+        return NetKeibaScraper._parse_odds(content)
+
+    async def get_races_bulk(self, race_ids):
+        """複数レースの結果をまとめて並行取得する
+
+        集約レイヤなので、取得に失敗したレースはログを残して
+        空の DataFrame で埋める。
+        """
+        async def fetch(race_id):
+            try:
+                return await self.get_race_result(race_id)
+            except NetKeibaError:
+                logger.exception('レース結果の取得に失敗: %s', race_id)
+                return pd.DataFrame(columns=list(_RESULT_FRAME_COLUMNS))
+
+        return await asyncio.gather(
+            *(fetch(race_id) for race_id in race_ids))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    scraper = NetKeibaScraper()
+    races = scraper.get_race_list(datetime.now().strftime('%Y%m%d'))
+    print(f'{len(races)}件のレースが見つかりました')
+    # 取得はネットワーク待ちが支配的なので全レースを並列に流す
+    # （HTTPアダプタのプールはワーカー数より広く取ってある）
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        futures = {
+            executor.submit(scraper.get_race_result_list,
+                            race['race_id']): race
+            for race in races
+        }
+        for future in as_completed(futures):
+            race = futures[future]
+            try:
+                result = future.result()
+            except NetKeibaError:
+                logger.exception('取得に失敗: %s', race['race_id'])
+                continue
+            print(f"{race['race_id']}: {len(result)}件")
+            for row in result:
+                print(row)
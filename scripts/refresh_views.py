@@ -0,0 +1,25 @@
+"""マテリアライズドビューの夜間リフレッシュ用CLI
+
+cron 例:
+    0 4 * * * /opt/keiba-ai/venv/bin/python /opt/keiba-ai/scripts/refresh_views.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager
+
+
+def main():
+    db_url = os.environ.get('DATABASE_URL', 'sqlite:///keiba_data.db')
+    db = DatabaseManager(db_url)
+    if not db.has_horse_stats_views:
+        print('マテリアライズドビュー未対応のDBのためスキップします')
+        return
+    db.refresh_horse_stats_views()
+    print('マテリアライズドビューを更新しました')
+
+
+if __name__ == '__main__':
+    main()
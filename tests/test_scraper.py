@@ -0,0 +1,57 @@
+"""スクレイパのパース系メソッドのテスト（ネットワーク不要）"""
+import pandas as pd
+
+from scraper import _RESULT_FRAME_COLUMNS, NetKeibaScraper
+
+# netkeiba の結果表（race_table_01）を模したフィクスチャ。
+# 2行目は出走中止（着順が数値でない）かつ馬リンクなしの行
+_RESULT_PAGE = """
+<html><body>
+<table class="race_table_01">
+  <tr>
+    <th>着順</th><th>枠番</th><th>馬番</th><th>馬名</th><th>性齢</th>
+    <th>斤量</th><th>騎手</th><th>タイム</th><th>着差</th><th>通過</th>
+    <th>上り</th><th>単勝</th><th>単勝</th><th>人気</th><th>馬体重</th>
+  </tr>
+  <tr>
+    <td>1</td><td>1</td><td>5</td>
+    <td><a href="/horse/2019104123/">テストホース</a></td>
+    <td>牡3</td><td>57</td><td>テスト騎手</td><td>1:58.2</td>
+    <td></td><td>3-3-2-1</td><td>34.5</td><td></td>
+    <td>2.4</td><td>1</td><td>480(+2)</td>
+  </tr>
+  <tr>
+    <td>中</td><td>8</td><td>16</td>
+    <td>リンクナシ</td>
+    <td>牝3</td><td>55</td><td>騎手二</td><td></td>
+    <td></td><td></td><td></td><td></td>
+    <td></td><td></td><td></td>
+  </tr>
+</table>
+</body></html>
+"""
+
+
+def test_parse_race_result_fixture_table():
+    df = NetKeibaScraper._parse_race_result(_RESULT_PAGE)
+
+    assert list(df.columns) == list(_RESULT_FRAME_COLUMNS)
+    assert len(df) == 2
+    # 着順・馬番・人気は欠損を保持できる nullable Int64
+    assert str(df['ranking'].dtype) == 'Int64'
+    assert str(df['popularity'].dtype) == 'Int64'
+    assert df['ranking'].iloc[0] == 1
+    assert pd.isna(df['ranking'].iloc[1])
+    assert df['horse_number'].tolist() == [5, 16]
+    assert df['horse_name'].tolist() == ['テストホース', 'リンクナシ']
+    # 馬リンクから horse_id を抜く。リンクなし行は欠損
+    assert df['horse_id'].iloc[0] == '2019104123'
+    assert pd.isna(df['horse_id'].iloc[1])
+    assert df['odds'].iloc[0] == 2.4
+    assert df['horse_weight'].iloc[0] == '480(+2)'
+
+
+def test_parse_race_result_empty_page():
+    df = NetKeibaScraper._parse_race_result('<html><body></body></html>')
+    assert df.empty
+    assert list(df.columns) == list(_RESULT_FRAME_COLUMNS)